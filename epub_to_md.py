@@ -8,13 +8,15 @@ EPUB内容提取器
 
 import sys
 import os
+import posixpath
 import zipfile
-import xml.etree.ElementTree as ET
+from lxml import etree
+from lxml import html as lxml_html
 import html2text
-from bs4 import BeautifulSoup
 import argparse
 import re
 import shutil
+import time
 import uuid
 import tempfile
 from pathlib import Path
@@ -22,9 +24,271 @@ import requests
 from io import BytesIO
 import logging
 import asyncio
+import queue
+import threading
+import concurrent.futures
 from oss_uploader import OSSUploader
 from task_manager import task_manager, TaskStatus
 
+# EPUB相关的XML命名空间
+_NS = {
+    'c': 'urn:oasis:names:tc:opendocument:xmlns:container',
+    'opf': 'http://www.idpf.org/2007/opf',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+}
+
+# 预编译的XPath表达式（lxml在模块加载时编译一次，避免每本书重复编译）
+_XP_ROOTFILE = etree.XPath('//c:rootfile/@full-path', namespaces=_NS)
+_XP_TITLE = etree.XPath('//opf:metadata/dc:title/text()', namespaces=_NS)
+_XP_CREATOR = etree.XPath('//opf:metadata/dc:creator/text()', namespaces=_NS)
+_XP_ITEMREFS = etree.XPath('//opf:spine/opf:itemref/@idref', namespaces=_NS)
+_XP_CONTENT_ITEMS = etree.XPath(
+    '//opf:manifest/opf:item[@media-type="application/xhtml+xml" or @media-type="text/html"]',
+    namespaces=_NS)
+_XP_IMAGE_ITEMS = etree.XPath(
+    '//opf:manifest/opf:item[starts-with(@media-type, "image/")]',
+    namespaces=_NS)
+
+# 预编译的正则表达式（每个章节都会用到，编译一次避免重复的缓存查找）
+_RE_PROD = re.compile(r'(\d{6}-\d{2})')
+
+# 章节HTML解析器：EPUB规范要求内容文档使用UTF-8/UTF-16编码，
+# 显式指定UTF-8，避免libxml2对缺少编码声明的文档按latin-1解码
+_HTML_PARSER = lxml_html.HTMLParser(encoding='utf-8')
+
+# 在原始HTML字节上定位<img>的src属性（html2text回退路径使用）
+_RE_IMG_SRC = re.compile(rb'(<img[^>]*\ssrc=")([^"]+)(")', re.I)
+
+# 小于该大小的EPUB直接在内存中处理，不经过磁盘临时文件
+_IN_MEMORY_LIMIT = 5 * 1024 * 1024
+_RE_HEAD = re.compile(r'^#+\s*')
+_RE_FMT = re.compile(r'[`*_]')
+# Markdown后处理：多余空行、空alt图片、空代码块，合并成一次扫描
+_RE_POST = re.compile(r'\n{3,}|!\[\]\(([^)]+)\)|```\s+```')
+
+def _post_fix(match):
+    """Markdown后处理的替换分发：根据命中的分支返回对应的修正文本"""
+    matched = match.group(0)
+    if matched[0] == '\n':
+        return '\n\n'  # 删除多余空行
+    if matched[0] == '!':
+        return f'![图片]({match.group(1)})'  # 优化图片引用格式
+    return ''  # 删除空代码块
+
+# 标题前补空行：仅用于html2text回退输出（single_line_break会产出单换行分隔的
+# 标题，且其代码块按4空格缩进，不会误伤以"# "开头的代码行）；
+# 直接渲染路径的块级输出天然以空行分隔，对```围栏内容应用此修正反而会破坏代码块
+_RE_HEAD_SPACE = re.compile(r'(?<!\n)\n(#{1,6} )')
+
+class _UnsupportedTag(Exception):
+    """直接渲染器遇到不支持的标签时抛出，触发html2text回退"""
+    pass
+
+def _inline_children(el):
+    """渲染el的行内子内容，返回Markdown文本"""
+    parts = [el.text or '']
+    for child in el:
+        parts.append(_inline_element(child))
+        if child.tail:
+            parts.append(child.tail)
+    return ''.join(parts)
+
+def _inline_element(el):
+    """渲染单个行内元素（含其子内容），返回Markdown文本"""
+    tag = el.tag
+    if not isinstance(tag, str):  # 注释、处理指令等
+        return ''
+    if tag == 'br':
+        return '\n'
+    if tag == 'img':
+        alt = el.get('alt') or ''
+        return f"![{alt}]({el.get('src', '')})"
+    inner = _inline_children(el)
+    if not inner.strip():
+        return inner
+    if tag in ('strong', 'b'):
+        return f'**{inner}**'
+    if tag in ('em', 'i'):
+        return f'_{inner}_'
+    if tag == 'code':
+        return f'`{inner}`'
+    if tag == 'a':
+        href = el.get('href')
+        return f'[{inner}]({href})' if href else inner
+    return inner
+
+def _block_heading(el, out):
+    text = _inline_children(el).strip()
+    if text:
+        level = int(el.tag[1])
+        out.append('#' * level + ' ' + text + '\n\n')
+
+def _block_paragraph(el, out):
+    text = _inline_children(el).strip()
+    if text:
+        out.append(text + '\n\n')
+
+def _block_pre(el, out):
+    code = ''.join(el.itertext()).strip('\n')
+    if code:
+        out.append('```\n' + code + '\n```\n\n')
+
+def _block_blockquote(el, out):
+    inner = []
+    _render_block_children(el, inner)
+    text = ''.join(inner).strip()
+    if text:
+        out.append(''.join(f'> {line}\n' for line in text.split('\n')) + '\n')
+
+def _block_list(el, out, ordered=False):
+    index = 1
+    for li in el:
+        if li.tag != 'li':
+            continue
+        inner = []
+        _render_block_children(li, inner)
+        text = ''.join(inner).strip()
+        if not text:
+            continue
+        prefix = f'{index}. ' if ordered else '* '
+        lines = text.split('\n')
+        # 续行缩进到列表项内容的起始列
+        out.append(prefix + lines[0]
+                   + ''.join('\n' + ' ' * len(prefix) + line for line in lines[1:] if line)
+                   + '\n')
+        index += 1
+    out.append('\n')
+
+def _block_hr(el, out):
+    out.append('---\n\n')
+
+def _block_skip(el, out):
+    pass
+
+def _block_unsupported(el, out):
+    raise _UnsupportedTag(el.tag)
+
+def _has_block_descendant(el):
+    """判断元素是否包含块级后代（用于识别未收录的容器标签）"""
+    return any(isinstance(desc.tag, str) and desc.tag in _HTML2MD_TAG_HANDLERS
+               for desc in el.iterdescendants())
+
+def _render_block_children(el, out):
+    """按文档顺序渲染el的块级子元素，行内内容聚合成段落"""
+    pending = [el.text or '']
+
+    def flush():
+        text = ''.join(pending).strip()
+        del pending[:]
+        if text:
+            out.append(text + '\n\n')
+
+    for child in el:
+        tag = child.tag
+        if not isinstance(tag, str):  # 注释、处理指令等
+            handler = _block_skip
+        else:
+            handler = _HTML2MD_TAG_HANDLERS.get(tag)
+            if handler is None and _has_block_descendant(child):
+                # 未收录的标签若包含块级后代，按块级容器递归处理，
+                # 避免其中的标题、列表等被拍平成行内文本
+                handler = _render_block_children
+        if handler is not None:
+            flush()
+            handler(child, out)
+        else:
+            pending.append(_inline_element(child))
+        if child.tail:
+            pending.append(child.tail)
+    flush()
+
+# 标签到块级处理函数的映射（O(1)分发）；不在表中的标签按行内内容处理，
+# 表格等复杂结构交由html2text回退路径处理
+_HTML2MD_TAG_HANDLERS = {
+    'h1': _block_heading,
+    'h2': _block_heading,
+    'h3': _block_heading,
+    'h4': _block_heading,
+    'h5': _block_heading,
+    'h6': _block_heading,
+    'p': _block_paragraph,
+    'figcaption': _block_paragraph,
+    'dt': _block_paragraph,
+    'dd': _block_paragraph,
+    'pre': _block_pre,
+    'blockquote': _block_blockquote,
+    'ul': _block_list,
+    'ol': lambda el, out: _block_list(el, out, ordered=True),
+    'div': _render_block_children,
+    'section': _render_block_children,
+    'article': _render_block_children,
+    'aside': _render_block_children,
+    'figure': _render_block_children,
+    'header': _render_block_children,
+    'footer': _render_block_children,
+    'nav': _render_block_children,
+    'main': _render_block_children,
+    'dl': _render_block_children,
+    'hr': _block_hr,
+    'script': _block_skip,
+    'style': _block_skip,
+    'table': _block_unsupported,
+}
+
+def _render_markdown(root):
+    """
+    直接从lxml元素树渲染Markdown
+
+    跳过html2text的"序列化+重新解析"往返；遇到不支持的标签时
+    抛出_UnsupportedTag，由调用方回退到html2text。
+
+    Args:
+        root: lxml的HTML根元素
+
+    Returns:
+        渲染出的Markdown文本
+    """
+    body = root.find('.//body')
+    if body is None:
+        body = root
+    out = []
+    _render_block_children(body, out)
+    return ''.join(out)
+
+def _make_h2t():
+    """
+    创建配置好的html2text转换器实例
+
+    html2text在handle调用之间会保留内部状态，并行转换时每个章节
+    需要独立的实例。
+
+    Returns:
+        配置好的HTML2Text实例
+    """
+    h2t = html2text.HTML2Text()
+    h2t.ignore_links = False
+    h2t.ignore_images = False
+    h2t.escape_snob = False
+    h2t.ignore_tables = False
+    h2t.body_width = 0  # 不自动断行
+    h2t.unicode_snob = True  # 使用Unicode
+    h2t.mark_code = True
+    h2t.wrap_links = False
+    h2t.wrap_lists = False
+    h2t.single_line_break = True  # 单个换行符不被忽略
+    return h2t
+
+# 每个线程复用一个html2text实例，避免逐章节重新构造和设置标志
+_h2t_local = threading.local()
+
+def _get_h2t():
+    """获取当前线程的html2text转换器实例（按线程缓存复用）"""
+    h2t = getattr(_h2t_local, 'h2t', None)
+    if h2t is None:
+        h2t = _make_h2t()
+        _h2t_local.h2t = h2t
+    return h2t
+
 def get_product_id(filename):
     """
     从文件名中提取产品编号
@@ -35,7 +299,7 @@ def get_product_id(filename):
     Returns:
         产品编号
     """
-    match = re.match(r'(\d{6}-\d{2})', filename)
+    match = _RE_PROD.match(filename)
     if match:
         return match.group(1)
     return None
@@ -55,8 +319,8 @@ def get_first_line_content(markdown_path):
             first_line = f.readline().strip()
             
         # 移除Markdown标记
-        content = re.sub(r'^#+\s*', '', first_line)  # 移除标题标记
-        content = re.sub(r'[`*_]', '', content)      # 移除其他格式标记
+        content = _RE_HEAD.sub('', first_line)  # 移除标题标记
+        content = _RE_FMT.sub('', content)      # 移除其他格式标记
         
         return content if content else None
         
@@ -117,22 +381,49 @@ async def upload_to_oss(product_code: str, data_dir: str) -> bool:
         await task_manager.update_task_status(product_code, "epub-to-md", TaskStatus.FAIL, f"上传失败: {str(e)}")
         return False
 
+# 后台上传线程池：上传和后续EPUB的提取重叠进行，也不依赖当前线程有事件循环
+_UPLOAD_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+def _upload_with_retry(product_code, data_dir, attempts=3):
+    """
+    在后台线程中执行OSS上传，失败时按指数退避重试
+
+    Args:
+        product_code: 产品代码
+        data_dir: 数据目录
+        attempts: 最大尝试次数
+
+    Returns:
+        bool: 上传是否成功
+    """
+    for attempt in range(attempts):
+        try:
+            if asyncio.run(upload_to_oss(product_code, data_dir)):
+                return True
+        except Exception as e:
+            logging.error(f"OSS上传异常: {str(e)}")
+        if attempt < attempts - 1:
+            time.sleep(2 ** attempt)  # 指数退避
+    return False
+
 def extract_content_from_epub(epub_path, product_code, md_img_dir=None, save=False):
     """
     从EPUB文件中提取内容并转换为Markdown格式
     
     Args:
-        epub_path: EPUB文件的路径
+        epub_path: EPUB文件的路径或文件对象（小文件可直接传内存中的BytesIO）
         product_code: 产品编号
         md_img_dir: Markdown文件中图片引用的基础路径
         save: 是否保存文件
-    
+
     Returns:
         提取的Markdown文本内容
     """
-    # 转换为Path对象
-    epub_path = Path(epub_path)
-    
+    # 路径参数转换为Path对象；文件对象直接交给ZipFile
+    is_fileobj = hasattr(epub_path, 'read')
+    if not is_fileobj:
+        epub_path = Path(epub_path)
+
     # 设置输出路径和图片目录
     if save:
         output_path = Path(f"./data/{product_code}/epub/{product_code}.epub.md")
@@ -158,103 +449,77 @@ def extract_content_from_epub(epub_path, product_code, md_img_dir=None, save=Fal
     print(f"  md_img_dir: {md_img_dir}")
     print(f"  product_code: {product_code}")
     
-    if not epub_path.exists():
+    if not is_fileobj and not epub_path.exists():
         print(f"错误: 文件 '{epub_path}' 不存在")
         return None
     
-    # 创建html2text转换器实例
-    h2t = html2text.HTML2Text()
-    h2t.ignore_links = False
-    h2t.ignore_images = False
-    h2t.escape_snob = False
-    h2t.ignore_tables = False
-    h2t.body_width = 0  # 不自动断行
-    h2t.unicode_snob = True  # 使用Unicode
-    h2t.mark_code = True
-    h2t.wrap_links = False
-    h2t.wrap_lists = False
-    h2t.single_line_break = True  # 单个换行符不被忽略
-    
     try:
         # 打开EPUB文件(实际是ZIP文件)
         with zipfile.ZipFile(epub_path, 'r') as epub:
             # 首先查找OPF文件位置
-            container = epub.read('META-INF/container.xml')
-            container_root = ET.fromstring(container)
-            opf_path = container_root.find('.//{urn:oasis:names:tc:opendocument:xmlns:container}rootfile').get('full-path')
-            
+            container_root = etree.fromstring(epub.read('META-INF/container.xml'))
+            opf_path = _XP_ROOTFILE(container_root)[0]
+
             # 读取OPF文件，获取内容文件列表
-            opf_content = epub.read(opf_path)
-            opf_root = ET.fromstring(opf_content)
-            
+            opf_root = etree.fromstring(epub.read(opf_path))
+
             # 获取基础路径
             opf_dir = os.path.dirname(opf_path)
             if opf_dir and not opf_dir.endswith('/'):
                 opf_dir += '/'
-            
-            # 提取内容文件列表
-            manifest = opf_root.find('.//{http://www.idpf.org/2007/opf}manifest')
-            spine = opf_root.find('.//{http://www.idpf.org/2007/opf}spine')
-            
+
             # 获取标题和作者信息
-            metadata = opf_root.find('.//{http://www.idpf.org/2007/opf}metadata')
-            title = ""
-            author = ""
-            if metadata is not None:
-                title_elem = metadata.find('.//{http://purl.org/dc/elements/1.1/}title')
-                if title_elem is not None and title_elem.text:
-                    title = title_elem.text
-                
-                creator_elem = metadata.find('.//{http://purl.org/dc/elements/1.1/}creator')
-                if creator_elem is not None and creator_elem.text:
-                    author = creator_elem.text
-            
+            titles = _XP_TITLE(opf_root)
+            title = titles[0] if titles else ""
+            creators = _XP_CREATOR(opf_root)
+            author = creators[0] if creators else ""
+
             # 获取itemrefs的顺序
-            itemrefs = []
-            if spine is not None:
-                itemrefs = [item.get('idref') for item in spine.findall('.//{http://www.idpf.org/2007/opf}itemref')]
-            
-            # 收集所有内容项目
-            content_items = {}
-            image_items = {}
-            
-            for item in manifest.findall('.//{http://www.idpf.org/2007/opf}item'):
-                item_id = item.get('id')
-                href = item.get('href')
-                media_type = item.get('media-type')
-                
-                if media_type in ['application/xhtml+xml', 'text/html']:
-                    content_items[item_id] = href
-                elif media_type.startswith('image/'):
-                    image_items[item_id] = href
+            itemrefs = list(_XP_ITEMREFS(opf_root))
+
+            # 收集所有内容项目（media-type的筛选由XPath在libxml2中完成）
+            content_items = {item.get('id'): item.get('href') for item in _XP_CONTENT_ITEMS(opf_root)}
+            image_items = {item.get('id'): item.get('href') for item in _XP_IMAGE_ITEMS(opf_root)}
             
+            # 拿到名称到ZipInfo的映射，后续按ZipInfo读取，省去每次按名称的查找和校验
+            name_to_info = epub.NameToInfo
+
             # 保存所有图片，并创建图片ID到保存路径的映射
+            # 解压（zlib会释放GIL）和磁盘写入用线程池并行执行；
+            # ZipFile内部对共享文件句柄加锁，多线程open/read是安全的
             image_map = {}
-            
-            for image_id, image_href in image_items.items():
+
+            def _extract_one_image(job):
+                image_id, image_href = job
                 try:
-                    # 构建完整的图片路径
-                    image_path = os.path.join(opf_dir, image_href)
+                    # 构建完整的图片路径（zip内的路径总是用"/"分隔，按posix规则拼接）
+                    image_path = posixpath.join(opf_dir, image_href)
                     # 提取图片文件扩展名
                     _, ext = os.path.splitext(image_href)
                     # 生成唯一的图片文件名
                     new_image_name = f"{image_id}{ext}"
                     save_path = os.path.join(image_dir, new_image_name)
-                    
-                    # 读取并保存图片
-                    with open(save_path, 'wb') as img_file:
-                        img_file.write(epub.read(image_path))
-                    
+
+                    # 流式读取并保存图片（64KB缓冲，避免整张图片在内存中落地）
+                    with epub.open(name_to_info[image_path]) as src, open(save_path, 'wb') as img_file:
+                        shutil.copyfileobj(src, img_file, 1 << 16)
+
                     # 构建Markdown中引用的图片路径（使用md_img_dir）
                     md_image_path = f"{md_img_dir}/{new_image_name}"
-                    
-                    # 记录图片ID到保存路径的映射
-                    image_map[os.path.basename(image_href)] = md_image_path
-                    
-                    # 如果href中包含了路径信息，也创建一个映射，因为HTML中的引用可能是相对路径
+
+                    # 记录图片href到保存路径的映射
                     image_map[image_href] = md_image_path
+
+                    # 如果href中包含了路径信息，再按文件名建一个映射，因为HTML中的引用可能是相对路径
+                    base_name = os.path.basename(image_href)
+                    if base_name != image_href:
+                        image_map[base_name] = md_image_path
                 except Exception as e:
                     print(f"保存图片 {image_href} 时出错: {str(e)}")
+
+            if image_items:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                    list(executor.map(_extract_one_image, image_items.items()))
             
             # 开始创建Markdown文件内容
             markdown_content = []
@@ -267,34 +532,74 @@ def extract_content_from_epub(epub_path, product_code, md_img_dir=None, save=Fal
             
             # 按照spine中的顺序提取内容
             if itemrefs:
-                for idref in itemrefs:
-                    if idref in content_items:
-                        file_path = content_items[idref]
-                        convert_html_to_markdown(epub, opf_dir, file_path, markdown_content, image_map, h2t)
+                chapter_paths = [content_items[idref] for idref in itemrefs if idref in content_items]
             else:
                 # 如果没有spine，则直接按顺序提取所有HTML文件
-                for _, file_path in content_items.items():
-                    convert_html_to_markdown(epub, opf_dir, file_path, markdown_content, image_map, h2t)
+                chapter_paths = list(content_items.values())
+
+            # 章节转换流水线：读取线程独占zip句柄负责解压（zlib释放GIL），
+            # 转换线程池负责解析和渲染，两级之间用有界队列衔接，
+            # 使解压和转换相互重叠；结果按spine顺序回填
+            if chapter_paths:
+                worker_count = min(8, os.cpu_count() or 4)
+                chapter_queue = queue.Queue(maxsize=worker_count * 2)
+                results = [None] * len(chapter_paths)
+
+                def _read_chapters():
+                    for index, file_path in enumerate(chapter_paths):
+                        # zip内的路径总是用"/"分隔，按posix规则拼接
+                        full_path = posixpath.join(opf_dir, file_path)
+                        info = name_to_info.get(full_path)
+                        if info is None:
+                            print(f"无法找到文件: {full_path}")
+                            data = None
+                        else:
+                            data = epub.read(info)
+                        chapter_queue.put((index, file_path, data))
+                    # 每个转换线程一个结束哨兵
+                    for _ in range(worker_count):
+                        chapter_queue.put(None)
+
+                def _convert_chapters():
+                    while True:
+                        job = chapter_queue.get()
+                        if job is None:
+                            break
+                        index, file_path, data = job
+                        if data is not None:
+                            results[index] = convert_html_to_markdown(data, file_path, image_map, _get_h2t())
+
+                reader = threading.Thread(target=_read_chapters)
+                reader.start()
+                with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+                    futures = [executor.submit(_convert_chapters) for _ in range(worker_count)]
+                    for future in futures:
+                        future.result()
+                reader.join()
+
+                markdown_content.extend(md_content for md_content in results if md_content is not None)
             
-            # 写入输出文件
+            # 逐块写入输出文件，避免对整本书的大字符串再做一次编码缓冲
             with open(output_path, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(markdown_content))
-            
+                for index, chunk in enumerate(markdown_content):
+                    if index:
+                        f.write('\n')
+                    f.write(chunk)
+
+            # 拼接结果直接作为返回值（避免写入后再重读一遍）
+            markdown_text = '\n'.join(markdown_content)
+
             print(f"内容已成功提取到Markdown文件: {output_path}")
             print(f"图片已保存到目录: {image_dir}")
             print(f"Markdown中的图片引用路径: {md_img_dir}")
-            
-            # 读取生成的Markdown内容
-            with open(output_path, 'r', encoding='utf-8') as f:
-                markdown_text = f.read()
-            
+
             # 如果不保存，则删除临时文件
             if not save:
                 shutil.rmtree(temp_dir)
             
-            # 在保存文件后，启动异步上传任务
+            # 在保存文件后，把上传提交到后台线程池（带重试）
             if save:
-                asyncio.create_task(upload_to_oss(product_code, os.path.join(os.getcwd(), "data")))
+                _UPLOAD_POOL.submit(_upload_with_retry, product_code, os.path.join(os.getcwd(), "data"))
             
             return markdown_text
             
@@ -302,56 +607,53 @@ def extract_content_from_epub(epub_path, product_code, md_img_dir=None, save=Fal
         print(f"提取过程中出错: {str(e)}")
         return None
 
-def convert_html_to_markdown(epub, opf_dir, file_path, markdown_content, image_map, h2t):
-    """将HTML内容转换为Markdown格式"""
+def _rewrite_img_src(match, image_map):
+    """在原始HTML字节上替换单个img的src属性（查找逻辑与lxml路径一致）"""
+    src = match.group(2).decode('utf-8', 'ignore')
+    mapped = image_map.get(src) or image_map.get(src.rsplit('/', 1)[-1])
+    if mapped:
+        return match.group(1) + mapped.encode('utf-8') + match.group(3)
+    return match.group(0)
+
+def convert_html_to_markdown(file_content, file_path, image_map, h2t):
+    """将一个章节的HTML内容（字节串）转换为Markdown格式，返回转换结果（失败时返回None）"""
     try:
-        full_path = os.path.join(opf_dir, file_path)
-        file_content = epub.read(full_path)
-        
-        # 使用Beautiful Soup解析HTML
-        soup = BeautifulSoup(file_content, 'html.parser')
-        
+        # 使用lxml解析HTML（C实现，容忍不规范的标记）
+        root = lxml_html.fromstring(file_content, parser=_HTML_PARSER)
+
         # 处理图片路径，将其替换为本地保存的图片路径
-        for img in soup.find_all('img'):
+        for img in root.iter('img'):
             src = img.get('src')
             if src:
-                # 尝试在映射中查找图片
-                if src in image_map:
-                    img['src'] = image_map[src]
-                else:
-                    # 尝试通过文件名匹配
-                    img_name = os.path.basename(src)
-                    if img_name in image_map:
-                        img['src'] = image_map[img_name]
-        
-        # 优化标题处理
-        for i, heading in enumerate(soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])):
-            # 确保标题元素前有一个空行
-            if i > 0:  # 跳过第一个标题，因为可能是章节标题
-                new_tag = soup.new_tag('p')
-                new_tag.string = ""
-                heading.insert_before(new_tag)
-        
-        # 转换为Markdown
-        html_content = str(soup)
-        md_content = h2t.handle(html_content)
-        
-        # 后处理Markdown内容
-        # 1. 修复可能的格式问题
-        md_content = re.sub(r'\n{3,}', '\n\n', md_content)  # 删除多余空行
-        
-        # 2. 优化图片引用格式
-        md_content = re.sub(r'!\[\]\(([^)]+)\)', r'![图片](\1)', md_content)
-        
-        # 3. 确保代码块格式正确
-        md_content = re.sub(r'```\s+```', '', md_content)  # 删除空代码块
-        
-        markdown_content.append(md_content)
+                # 先按完整路径查找，再按文件名匹配（rsplit比os.path.basename更轻量）
+                mapped = image_map.get(src) or image_map.get(src.rsplit('/', 1)[-1])
+                if mapped:
+                    img.set('src', mapped)
+
+        # 转换为Markdown：优先直接遍历lxml树渲染，省去html2text路径的
+        # "序列化+重新解析"往返；遇到不支持的标签（如表格）时回退
+        try:
+            md_content = _render_markdown(root)
+        except _UnsupportedTag:
+            # 回退路径直接在原始HTML字节上重写img的src后交给html2text，
+            # 避免把整棵lxml树重新序列化一遍；非UTF-8章节仍走序列化
+            try:
+                html_text = _RE_IMG_SRC.sub(
+                    lambda m: _rewrite_img_src(m, image_map), file_content).decode('utf-8')
+            except UnicodeDecodeError:
+                html_text = lxml_html.tostring(root, encoding='unicode')
+            md_content = h2t.handle(html_text)
+            # 确保标题前有一个空行
+            md_content = _RE_HEAD_SPACE.sub(r'\n\n\1', md_content)
         
-    except KeyError:
-        print(f"无法找到文件: {full_path}")
+        # 后处理Markdown内容：一次扫描修复空行、图片引用和空代码块
+        md_content = _RE_POST.sub(_post_fix, md_content)
+
+        return md_content
+
     except Exception as e:
         print(f"处理文件 {file_path} 时出错: {str(e)}")
+        return None
 
 def process_epub_file(file_content, product_code, md_img_dir=None, save=False):
     """
@@ -366,6 +668,10 @@ def process_epub_file(file_content, product_code, md_img_dir=None, save=False):
     Returns:
         提取的内容写入Markdown文件，图片保存到指定目录，并返回输出文件的路径
     """
+    # 小文件直接在内存中处理，省去临时文件的一写一读
+    if len(file_content) < _IN_MEMORY_LIMIT:
+        return extract_content_from_epub(BytesIO(file_content), product_code, md_img_dir, save)
+
     # 创建临时文件
     with tempfile.NamedTemporaryFile(delete=False, suffix='.epub') as temp_file:
         temp_file.write(file_content)
@@ -396,11 +702,20 @@ def process_epub_url(url, product_code, md_img_dir=None, save=False):
         # 下载EPUB文件
         response = requests.get(url, stream=True)
         response.raise_for_status()
-        
+
+        # 小文件直接下载到内存中处理，不经过磁盘
+        try:
+            content_length = int(response.headers.get('Content-Length') or 0)
+        except ValueError:
+            content_length = 0  # 非法的Content-Length按未知大小处理，走临时文件路径
+        if 0 < content_length < _IN_MEMORY_LIMIT:
+            return extract_content_from_epub(BytesIO(response.content), product_code, md_img_dir, save)
+
         # 创建临时文件
         with tempfile.NamedTemporaryFile(delete=False, suffix='.epub') as temp_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
+            # 从底层响应流直接复制到临时文件（256KB缓冲），省去Python层的逐块循环
+            response.raw.decode_content = True
+            shutil.copyfileobj(response.raw, temp_file, 1 << 18)
             temp_file_path = temp_file.name
         
         try:
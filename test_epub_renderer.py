@@ -0,0 +1,112 @@
+"""epub_to_md直接渲染器的测试
+
+只测试纯渲染逻辑，不依赖外部服务：导入epub_to_md前先替换
+task_manager和oss_uploader，避免测试环境连接Redis/OSS。
+"""
+
+import sys
+import types
+
+_task_manager_stub = types.ModuleType('task_manager')
+_task_manager_stub.task_manager = object()
+_task_manager_stub.TaskStatus = object
+sys.modules.setdefault('task_manager', _task_manager_stub)
+
+_oss_uploader_stub = types.ModuleType('oss_uploader')
+_oss_uploader_stub.OSSUploader = object
+sys.modules.setdefault('oss_uploader', _oss_uploader_stub)
+
+import epub_to_md
+
+
+def _convert(html):
+    return epub_to_md.convert_html_to_markdown(
+        html.encode('utf-8'), 'chapter.xhtml', {}, epub_to_md._make_h2t())
+
+
+def test_wrapped_heading_and_nav():
+    """header/nav/main等容器中的标题和列表不能被拍平成行内文本"""
+    html = (
+        '<html><body>'
+        '<header><h1>Chapter Two</h1></header>'
+        '<nav><ol><li><a href="c1.xhtml">第一节</a></li>'
+        '<li><a href="c2.xhtml">第二节</a></li></ol></nav>'
+        '<main><h2>Inside main</h2><p>Body text.</p></main>'
+        '</body></html>'
+    )
+    md = _convert(html)
+    lines = md.split('\n')
+    assert '# Chapter Two' in lines
+    assert '## Inside main' in lines
+    assert '1. [第一节](c1.xhtml)' in lines
+    assert '2. [第二节](c2.xhtml)' in lines
+    # 相邻块之间必须有分隔，不能出现文字粘连
+    assert 'Inside mainBody text.' not in md
+    assert 'Body text.' in lines
+
+
+def test_unknown_container_with_block_descendants():
+    """未收录的容器标签包含块级后代时按块级容器递归"""
+    html = (
+        '<html><body>'
+        '<hgroup><h1>标题</h1><p>副标题</p></hgroup>'
+        '</body></html>'
+    )
+    md = _convert(html)
+    lines = md.split('\n')
+    assert '# 标题' in lines
+    assert '副标题' in lines
+
+
+def test_basic_blocks():
+    """常规块级元素的渲染格式"""
+    html = (
+        '<html><body>'
+        '<h1>第一章</h1>'
+        '<p>这是<strong>加粗</strong>和<em>强调</em>。</p>'
+        '<img src="images/a.png" alt=""/>'
+        '<ul><li>甲</li><li>乙</li></ul>'
+        '<pre><code>print("hi")</code></pre>'
+        '</body></html>'
+    )
+    md = _convert(html)
+    assert '# 第一章' in md
+    assert '这是**加粗**和_强调_。' in md
+    assert '![图片](images/a.png)' in md
+    assert '* 甲' in md and '* 乙' in md
+    assert '```\nprint("hi")\n```' in md
+
+
+def test_code_block_comment_lines_untouched():
+    """代码块中以"# "开头的行不能被当作标题补空行"""
+    html = (
+        '<html><body><h1>脚本</h1>'
+        '<pre>#!/bin/sh\n# install deps\napt-get install -y foo</pre>'
+        '</body></html>'
+    )
+    md = _convert(html)
+    assert '```\n#!/bin/sh\n# install deps\napt-get install -y foo\n```' in md
+
+
+def test_fallback_heading_gets_blank_line():
+    """html2text回退输出中的标题前要补出空行"""
+    html = (
+        '<html><body>'
+        '<p>引言</p><h2>标题</h2>'
+        '<table><tr><td>x</td></tr></table>'
+        '</body></html>'
+    )
+    md = _convert(html)
+    assert '引言\n\n## 标题' in md
+
+
+def test_table_falls_back_to_html2text():
+    """包含表格的章节回退到html2text，内容不丢失"""
+    html = (
+        '<html><body><h1>T</h1>'
+        '<table><tr><th>A</th></tr><tr><td>1</td></tr></table>'
+        '<p>after</p></body></html>'
+    )
+    md = _convert(html)
+    assert md is not None
+    assert 'A' in md and '1' in md and 'after' in md